@@ -42,37 +42,118 @@ CENTER_TOL_X, CENTER_TOL_Y = 8, 8
 GAIN_PAN, GAIN_TILT = 0.05, 0.05
 LOST_TIMEOUT = 2.0  # seconds since last_seen → start scanning
 
+# Servo writer thread: pushes the latest pan/tilt targets to the PCA9685
+SERVO_PERIOD = 0.01  # seconds between checks (100 Hz)
+SERVO_DEADBAND = 0.5  # degrees of change needed before a new I²C write
+
 # Camera resolution (kept modest for speed)
 CAM_W, CAM_H = 300, 225
 
+# DNN worker threads: three of the Pi's four cores, leaving one for the
+# capture thread and Flask so they are not preempted on every frame
+DNN_THREADS = 3
+
+# MJPEG stream encoding (libjpeg default is quality 95)
+JPEG_QUALITY = 75
+
+# A stream client that gets no new frame for this long is re-sent the last
+# one, so the viewer's connection stays open through a stalled camera
+STREAM_TIMEOUT = 5.0
+
+# HUD text overlay
+HUD_H = 105  # frame rows covered by the text block
+HUD_FPS_PERIOD = 0.5  # seconds between fps readout updates
+
 # Face detector (OpenCV DNN Caffe model)
 FACE_PROTO = "deploy.prototxt"
 FACE_MODEL = "res10_300x300_ssd_iter_140000_fp16.caffemodel"
+FACE_MEAN = (104.0, 177.0, 123.0)  # BGR
 FACE_CONF = 0.5
 MIN_FACE_PIX = 225  # ~20×20 px
 FACE_HOLD_SEC = 0.1  # keep face mode this long after loss
 
+# While a face is locked, search only a small ROI around it and run the
+# full-frame face pass at a lower cadence (or immediately on ROI loss)
+FACE_ROI_SIZE = 150  # net input size for the ROI pass
+FACE_ROI_PAD = 0.5  # ROI padding, as a fraction of the face box size
+FACE_FULL_INTERVAL = 0.5  # seconds between full-frame face passes
+
 # Person detector (MobileNet-SSD)
 PERSON_PROTO = "MobileNetSSD_deploy.prototxt"
 PERSON_MODEL = "MobileNetSSD_deploy.caffemodel"
+PERSON_SCALE = 0.007843
+# Same input as the original blobFromImage(mean=127.5) call: a bare float
+# becomes Scalar(127.5, 0, 0, 0), so only channel 0 is shifted. PERSON_CONF
+# is tuned on this input.
+PERSON_MEAN = (127.5, 0.0, 0.0)
 PERSON_CLASS = 15  # "person" class index
 PERSON_CONF = 0.5
 MIN_BODY_FRAC = 0.02  # discard <2% of frame area
 
+# Without a face, rerun the person net only when the scene changed, the
+# rig moved, or on every BODY_EVERY-th frame; otherwise reuse its last box
+BODY_DIFF_THRESH = 3.0  # mean abs diff of a 32×24 thumbnail (0-255)
+BODY_EVERY = 3
+
+# Optional INT8 models for the ncnn runtime (see README). When the ncnn
+# Python package and all four files are present they replace the Caffe nets.
+FACE_NCNN_PARAM = "res10_300x300_ssd-int8.param"
+FACE_NCNN_BIN = "res10_300x300_ssd-int8.bin"
+PERSON_NCNN_PARAM = "MobileNetSSD_deploy-int8.param"
+PERSON_NCNN_BIN = "MobileNetSSD_deploy-int8.bin"
+
+# Optional NPU models, preferred over every CPU backend when both the
+# accelerator and the files are present (see README)
+FACE_HEF = "res10_300x300_ssd.hef"  # Hailo-8/8L, compiled with NMS
+PERSON_HEF = "MobileNetSSD_deploy.hef"
+FACE_TFLITE = "ssd_mobilenet_v2_face_quant_postprocess_edgetpu.tflite"
+PERSON_TFLITE = "ssd_mobilenet_v2_coco_quant_postprocess_edgetpu.tflite"
+COCO_PERSON_CLASS = 0  # "person" in the Coral COCO model
+
 # ────────────────────────────────────────────────────────────────────────
 
 import math
+import queue
+import threading
 import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import cv2
 import numpy as np
 import board
 import busio
-from picamera2 import Picamera2
+from picamera2 import MappedArray, Picamera2
 from adafruit_pca9685 import PCA9685
 from flask import Flask, Response, render_template_string, jsonify
 
+try:
+    import ncnn  # optional INT8 inference runtime
+except ImportError:
+    ncnn = None
+
+try:
+    import hailo_platform as hpf  # optional Hailo NPU runtime
+except ImportError:
+    hpf = None
+
+try:
+    from pycoral.adapters import common as coral_common
+    from pycoral.adapters import detect as coral_detect
+    from pycoral.utils import edgetpu  # optional Coral Edge TPU runtime
+except ImportError:
+    edgetpu = None
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:  # run the same functions as plain Python
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        return lambda fn: fn
+
 # ─── Servo setup ───────────────────────────────────────────────────────
 
 i2c = busio.I2C(board.SCL, board.SDA)
@@ -80,12 +161,39 @@ pca = PCA9685(i2c)
 pca.frequency = 50
 
 
+# Servo pulse ~500-2400 µs over 0-180°, as 16-bit duty of a 20 ms period,
+# folded into one offset and one slope
+DUTY_BASE = 500.0 * 65535.0 / 20000.0
+DUTY_PER_DEG = (1900.0 / 180.0) * 65535.0 / 20000.0
+
+
+@njit(cache=True)
+def angle_to_duty(ang: float) -> int:
+    """Clamp angle to [0, 180] and convert it to a PCA9685 duty cycle."""
+    return int(DUTY_BASE + max(0.0, min(180.0, ang)) * DUTY_PER_DEG)
+
+
+def scan_tilt(pan: float) -> float:
+    """Tilt angle of the scan pattern at a given pan angle."""
+    t_norm = (pan - PAN_CENTER) / SCAN_RANGE_PAN
+    tilt = TILT_CENTER + SCAN_RANGE_TILT * math.sin(
+        math.pi * SCAN_WAVES * t_norm
+    )
+    return max(TILT_MIN, min(TILT_MAX, tilt))
+
+
+# Scan steps are whole degrees of pan, so tabulate the pattern per degree
+scan_tilt_lut = np.array(
+    [scan_tilt(p) for p in range(PAN_MIN, PAN_MAX + 1)], np.float32
+)
+
+# Compile (or load from cache) now rather than on the first tracked frame
+angle_to_duty(90.0)
+
+
 def set_angle(ch: int, ang: float) -> None:
     """Clamp angle to [0, 180] and send to PCA9685."""
-    ang = max(0.0, min(180.0, ang))
-    pulse_us = 500.0 + (ang / 180.0) * 1900.0  # ~500-2400 µs
-    duty = int(pulse_us * 65535.0 / 20000.0)
-    pca.channels[ch].duty_cycle = duty
+    pca.channels[ch].duty_cycle = angle_to_duty(float(ang))
 
 
 pan, tilt = PAN_CENTER, TILT_CENTER
@@ -94,30 +202,407 @@ set_angle(TILT_CH, tilt)
 
 # ─── Camera ────────────────────────────────────────────────────────────
 
+# libcamera names formats by word order, so "RGB888" is stored as B, G, R
+# bytes, exactly what OpenCV and both Caffe nets' means expect. Frames go
+# straight into the DNNs with no channel swap ("BGR888" would be RGB).
 picam2 = Picamera2()
 picam2.configure(
     picam2.create_video_configuration(
         main={"size": (CAM_W, CAM_H), "format": "RGB888"},
-        buffer_count=1,
+        # One buffer waiting in frame_slot, one held by inference, and one
+        # being filled, so the camera never stalls on the pipeline
+        buffer_count=3,
     )
 )
 picam2.start()
 time.sleep(2.0)
 
+_probe = picam2.capture_array()
+if _probe.shape != (CAM_H, CAM_W, 3):
+    raise RuntimeError(
+        f"Unexpected camera frame shape {_probe.shape}, "
+        f"expected {(CAM_H, CAM_W, 3)} BGR"
+    )
+del _probe
+
 CX, CY = CAM_W // 2, CAM_H // 2  # image center
 
 # ─── Load DNNs ─────────────────────────────────────────────────────────
 
-for f in (FACE_PROTO, FACE_MODEL, PERSON_PROTO, PERSON_MODEL):
-    if not Path(f).exists():
-        raise FileNotFoundError(f"Missing model file: {f}")
+cv2.setNumThreads(DNN_THREADS)
+if "NEON" not in cv2.getBuildInformation():
+    print(
+        "[WARN] OpenCV was built without NEON; DNN inference will be slow. "
+        "Rebuild with -DENABLE_NEON=ON -DCPU_BASELINE=NEON"
+    )
+
+
+def _fill_blob_np(img, blob, m0, m1, m2, scale):
+    np.copyto(blob[0], img.transpose(2, 0, 1))
+    blob -= np.array((m0, m1, m2), np.float32)[:, None, None]
+    if scale != 1.0:
+        blob *= scale
+
+
+# Serial and nogil: both SSD threads call this at once, which numba's
+# parallel workqueue layer cannot handle, and without the GIL the two
+# fills (and the nets around them) still overlap
+@njit(nogil=True, fastmath=True, cache=True)
+def _fill_blob_jit(img, blob, m0, m1, m2, scale):
+    # One fused sweep: HWC uint8 → NCHW float32, mean-subtract and scale
+    for y in range(img.shape[0]):
+        for x in range(img.shape[1]):
+            blob[0, 0, y, x] = (img[y, x, 0] - m0) * scale
+            blob[0, 1, y, x] = (img[y, x, 1] - m1) * scale
+            blob[0, 2, y, x] = (img[y, x, 2] - m2) * scale
+
+
+# fill_blob(img, blob, m0, m1, m2, scale) writes (img - mean) * scale into
+# blob in place; the NumPy version takes three passes over the blob
+fill_blob = _fill_blob_jit if HAVE_NUMBA else _fill_blob_np
+fill_blob(  # warm the JIT cache
+    np.zeros((1, 1, 3), np.uint8), np.empty((1, 3, 1, 1), np.float32),
+    0.0, 0.0, 0.0, 1.0,
+)
+
+
+def _ssd_rows(rows) -> np.ndarray:
+    """Pack [image_id, class_id, conf, x1, y1, x2, y2] rows as (1, 1, N, 7)."""
+    return np.array(rows, np.float32).reshape(-1, 7)[None, None]
+
+
+class Detector(ABC):
+    """An SSD-style detector on one inference backend.
+
+    detect() takes a BGR image of any size and returns detections in
+    OpenCV's (1, 1, N, 7) layout [image_id, class_id, conf, x1, y1, x2, y2]
+    with coords normalized to that image and VOC class ids.
+    """
 
-net_face = cv2.dnn.readNetFromCaffe(FACE_PROTO, FACE_MODEL)
-net_person = cv2.dnn.readNetFromCaffe(PERSON_PROTO, PERSON_MODEL)
+    # True when the backend wants the shared 300×300 CPU resize; NPU
+    # backends resize to their own input size and take the raw frame
+    shared_resize = True
+
+    @abstractmethod
+    def detect(self, img: np.ndarray) -> np.ndarray: ...
+
+    def close(self):
+        """Release backend resources; the detector is unusable after."""
+
+
+class OpenCVDetector(Detector):
+    """Caffe SSD on OpenCV DNN (CPU)."""
+
+    def __init__(self, proto, model, size, scale, mean):
+        self.net = cv2.dnn.readNetFromCaffe(proto, model)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        # FP16 compute where the OpenCV build supports it (ARM, >= 4.9);
+        # halves the weight bytes read per conv layer. Else FP32 CPU.
+        try:
+            self.net.setPreferableTarget(
+                getattr(cv2.dnn, "DNN_TARGET_CPU_FP16", cv2.dnn.DNN_TARGET_CPU)
+            )
+        except cv2.error:
+            self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+        self.size, self.scale, self.mean = size, float(scale), mean
+        # Persistent inputs, filled in place every frame instead of
+        # reallocated by blobFromImage
+        self.resized = np.empty((size, size, 3), np.uint8)
+        self.blob = np.empty((1, 3, size, size), np.float32)
+
+    def detect(self, img):
+        # Same math as cv2.dnn.blobFromImage: (resize(img) - mean) * scale
+        if img.shape[:2] != (self.size, self.size):
+            img = cv2.resize(img, (self.size, self.size), dst=self.resized)
+        m0, m1, m2 = self.mean
+        fill_blob(img, self.blob, m0, m1, m2, self.scale)
+        self.net.setInput(self.blob)
+        return self.net.forward()
+
+
+class NcnnDetector(Detector):
+    """INT8 SSD on the ncnn runtime (CPU, NEON int8 kernels)."""
+
+    def __init__(self, net, size, scale, mean):
+        self.net = net
+        self.size = size
+        self.mean, self.norm = list(mean), [scale] * 3
+
+    @staticmethod
+    def load(param: str, model: str):
+        """Load an INT8 ncnn net produced by ncnn2int8."""
+        net = ncnn.Net()
+        net.opt.use_int8_inference = True
+        net.opt.num_threads = DNN_THREADS
+        net.load_param(param)
+        net.load_model(model)
+        return net
+
+    def detect(self, img):
+        img = np.ascontiguousarray(img)  # ROI crops are strided views
+        h, w = img.shape[:2]
+        mat = ncnn.Mat.from_pixels_resize(
+            img, ncnn.Mat.PixelType.PIXEL_BGR, w, h, self.size, self.size
+        )
+        mat.substract_mean_normalize(self.mean, self.norm)
+        ex = self.net.create_extractor()
+        ex.input("data", mat)
+        _, out = ex.extract("detection_out")
+        return self.rows(out)
+
+    @staticmethod
+    def rows(out) -> np.ndarray:
+        """Convert a DetectionOutput Mat to the (1, 1, N, 7) layout."""
+        # No detections → an empty Mat (dims 0); np.array() on it segfaults
+        if out.dims == 0:
+            return _ssd_rows([])
+        # ncnn rows are [class_id, conf, x1, y1, x2, y2]; add image_id
+        return _ssd_rows([(0, *out.row(i)) for i in range(out.h)])
+
+
+class HailoDetector(Detector):
+    """SSD compiled to a .hef with on-chip NMS, on a Hailo-8/8L NPU."""
+
+    shared_resize = False
+
+    def __init__(self, vdevice, hef_path: str, owns_device: bool = False):
+        hef = hpf.HEF(hef_path)
+        params = hpf.ConfigureParams.create_from_hef(
+            hef, interface=hpf.HailoStreamInterface.PCIe
+        )
+        group = vdevice.configure(hef, params)[0]
+        in_info = hef.get_input_vstream_infos()[0]
+        self.in_name = in_info.name
+        self.out_name = hef.get_output_vstream_infos()[0].name
+        self.h, self.w = in_info.shape[:2]
+        self.resized = np.empty((self.h, self.w, 3), np.uint8)
+
+        # Kept open until close(); the VDevice scheduler switches between
+        # the face and person networks
+        self.vstreams = hpf.InferVStreams(
+            group,
+            hpf.InputVStreamParams.make(
+                group, format_type=hpf.FormatType.UINT8
+            ),
+            hpf.OutputVStreamParams.make(
+                group, format_type=hpf.FormatType.FLOAT32
+            ),
+        )
+        self.pipe = self.vstreams.__enter__()
+        # The detector closed last releases the shared VDevice
+        self.vdevice = vdevice if owns_device else None
+
+    def detect(self, img):
+        cv2.resize(img, (self.w, self.h), dst=self.resized)
+        out = self.pipe.infer({self.in_name: self.resized[None]})
+        # NMS output: one (K, 5) [y1, x1, y2, x2, score] array per class,
+        # background excluded, so list index + 1 is the SSD class id
+        rows = []
+        for cls, boxes in enumerate(out[self.out_name][0], start=1):
+            for y1, x1, y2, x2, score in boxes:
+                rows.append((0, cls, score, x1, y1, x2, y2))
+        return _ssd_rows(rows)
+
+    def close(self):
+        self.vstreams.__exit__(None, None, None)
+        if self.vdevice is not None:
+            self.vdevice.release()
+
+
+class CoralDetector(Detector):
+    """Quantized SSD .tflite on a Coral Edge TPU."""
+
+    shared_resize = False
+
+    def __init__(self, model_path: str, classes=None):
+        self.interp = edgetpu.make_interpreter(model_path)
+        self.interp.allocate_tensors()
+        self.w, self.h = coral_common.input_size(self.interp)
+        self.resized = np.empty((self.h, self.w, 3), np.uint8)
+        self.rgb = np.empty_like(self.resized)
+        self.classes = classes  # model class id → VOC id, if they differ
+
+    def detect(self, img):
+        cv2.resize(img, (self.w, self.h), dst=self.resized)
+        cv2.cvtColor(self.resized, cv2.COLOR_BGR2RGB, dst=self.rgb)
+        coral_common.set_input(self.interp, self.rgb)
+        self.interp.invoke()
+
+        w, h = self.w, self.h
+        rows = []
+        for obj in coral_detect.get_objects(self.interp):
+            cls = obj.id
+            if self.classes is not None:
+                cls = self.classes.get(obj.id, -1)
+            b = obj.bbox
+            rows.append(
+                (0, cls, obj.score, b.xmin / w, b.ymin / h, b.xmax / w,
+                 b.ymax / h)
+            )
+        return _ssd_rows(rows)
+
+
+def _have(*files) -> bool:
+    return all(Path(f).exists() for f in files)
+
+
+def make_detectors():
+    """Build (backend, face, face_roi, person) on the fastest backend found.
+
+    Probes the Hailo NPU, then the Coral Edge TPU, then ncnn INT8 models,
+    and falls back to the Caffe models on OpenCV DNN.
+    """
+    if (
+        hpf is not None
+        and Path("/dev/hailo0").exists()
+        and _have(FACE_HEF, PERSON_HEF)
+    ):
+        params = hpf.VDevice.create_params()
+        params.scheduling_algorithm = hpf.HailoSchedulingAlgorithm.ROUND_ROBIN
+        vdevice = hpf.VDevice(params)
+        face = HailoDetector(vdevice, FACE_HEF)
+        person = HailoDetector(vdevice, PERSON_HEF, owns_device=True)
+        return "hailo", face, face, person
+
+    if (
+        edgetpu is not None
+        and _have(FACE_TFLITE, PERSON_TFLITE)
+        and edgetpu.list_edge_tpus()
+    ):
+        face = CoralDetector(FACE_TFLITE)
+        person = CoralDetector(
+            PERSON_TFLITE, classes={COCO_PERSON_CLASS: PERSON_CLASS}
+        )
+        return "coral", face, face, person
+
+    if ncnn is not None and _have(
+        FACE_NCNN_PARAM, FACE_NCNN_BIN, PERSON_NCNN_PARAM, PERSON_NCNN_BIN
+    ):
+        face_net = NcnnDetector.load(FACE_NCNN_PARAM, FACE_NCNN_BIN)
+        person_net = NcnnDetector.load(PERSON_NCNN_PARAM, PERSON_NCNN_BIN)
+        # The face net finds nothing on most frames; fail here, not with a
+        # crash mid-run, if the no-detection output is not handled
+        if NcnnDetector.rows(ncnn.Mat()).shape != (1, 1, 0, 7):
+            raise RuntimeError("ncnn: empty detection output not handled")
+        # ncnn handles varying input sizes per call, so the ROI pass
+        # shares the face net
+        return (
+            "ncnn",
+            NcnnDetector(face_net, 300, 1.0, FACE_MEAN),
+            NcnnDetector(face_net, FACE_ROI_SIZE, 1.0, FACE_MEAN),
+            NcnnDetector(person_net, 300, PERSON_SCALE, PERSON_MEAN),
+        )
+
+    for f in (FACE_PROTO, FACE_MODEL, PERSON_PROTO, PERSON_MODEL):
+        if not Path(f).exists():
+            raise FileNotFoundError(f"Missing model file: {f}")
+
+    # Separate instance for the small ROI input so neither net has to
+    # reallocate its layers when the input size alternates
+    return (
+        "opencv",
+        OpenCVDetector(FACE_PROTO, FACE_MODEL, 300, 1.0, FACE_MEAN),
+        OpenCVDetector(
+            FACE_PROTO, FACE_MODEL, FACE_ROI_SIZE, 1.0, FACE_MEAN
+        ),
+        OpenCVDetector(
+            PERSON_PROTO, PERSON_MODEL, 300, PERSON_SCALE, PERSON_MEAN
+        ),
+    )
+
+
+backend, face_det, face_roi_det, person_det = make_detectors()
+print(f"[INFO] Using {backend} detectors")
+
+
+def close_detectors():
+    """Close each detector once, the person net last.
+
+    On Hailo the person detector owns the VDevice the others run on.
+    """
+    closed = []
+    for det in (face_det, face_roi_det, person_det):
+        if det not in closed:
+            det.close()
+            closed.append(det)
+
+
+# Both full-frame passes share one 300×300 resize of the camera frame
+frame_300 = (
+    np.empty((300, 300, 3), np.uint8) if face_det.shared_resize else None
+)
+
+
+def full_frame_input(frame: np.ndarray) -> np.ndarray:
+    """Input for the full-frame face and person passes."""
+    if face_det.shared_resize:
+        return cv2.resize(frame, (300, 300), dst=frame_300)
+    return frame  # the backend resizes to its own input
+
+
+# Runs the person net alongside the face net; every backend releases the
+# GIL during inference, so both SSDs genuinely overlap
+dnn_pool = ThreadPoolExecutor(max_workers=2)
+
+
+def best_detection(
+    dets: np.ndarray,
+    w: int,
+    h: int,
+    ox: int,
+    oy: int,
+    min_conf: float,
+    min_area: float,
+    cls=None,
+):
+    """Pick the highest-confidence SSD box passing all filters.
+
+    dets are normalized to a w×h image sitting at (ox, oy) in the frame.
+    Returns (box, conf) in frame pixel coords, or (None, 0.0).
+    """
+    d = dets[0, 0]
+    keep = d[:, 2] >= min_conf
+    if cls is not None:
+        keep &= d[:, 1] == cls
+    d = d[keep]
+
+    boxes = (d[:, 3:7] * (w, h, w, h)).astype(np.int32) + (ox, oy, ox, oy)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    good = areas >= min_area
+    if not good.any():
+        return None, 0.0
+
+    confs = d[good, 2]
+    k = int(confs.argmax())
+    return tuple(int(v) for v in boxes[good][k]), float(confs[k])
+
+
+def best_face_in(det: Detector, img, region: tuple):
+    """Best face in img, which shows the (x1, y1, x2, y2) region of the frame.
+
+    img may be a crop or a resized copy of that region. Returns (box, conf)
+    with the box in full-frame pixel coords, or (None, 0.0) if nothing
+    passes the confidence and size filters.
+    """
+    det_f = det.detect(img)
+    x1, y1, x2, y2 = region
+    return best_detection(
+        det_f, x2 - x1, y2 - y1, x1, y1, FACE_CONF, MIN_FACE_PIX
+    )
+
+
+def face_roi(box):
+    """Padded search window around a face box, clipped to the frame."""
+    x1, y1, x2, y2 = box
+    pad = int(max(x2 - x1, y2 - y1) * FACE_ROI_PAD)
+    return (
+        max(0, x1 - pad),
+        max(0, y1 - pad),
+        min(CAM_W, x2 + pad),
+        min(CAM_H, y2 + pad),
+    )
 
-for net in (net_face, net_person):
-    net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
-    net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
 
 # ─── Flask UI ──────────────────────────────────────────────────────────
 
@@ -180,216 +665,394 @@ last_seen = 0.0
 
 last_face_time = 0.0
 last_face_box = None
+face_locked = False  # face found on the previous frame
+next_face_infer_t = 0.0  # next forced full-frame face pass
 
 last_conf = 0.0
 last_fx, last_fy = CX, CY
 
 tracking_mode = "none"  # "face", "body", or "none"
 
+# Person-net gating
+frame_idx = 0
+thumb_prev = None  # 32×24 thumbnail of the previous frame
+body_box, body_conf = None, 0.0  # last person result, reused when static
+body_pose = None  # (pan, tilt) when the person net last ran
 
-# ─── Stream generator ──────────────────────────────────────────────────
+fps_text, fps_t = "", 0.0  # HUD fps readout and when it was sampled
 
-def gen_frames():
-    global pan, tilt, scan_dir, last_seen
-    global last_face_time, last_face_box
-    global last_conf, last_fx, last_fy, tracking_mode
 
-    while True:
-        t0 = time.perf_counter()
+# ─── HUD ───────────────────────────────────────────────────────────────
+#
+# The text block is drawn into a cached BGRA layer only when one of its
+# strings changes, then copied onto each frame in a single masked blit.
+
+HUD_STYLE = (  # (origin, scale, BGR color, thickness) per line
+    ((5, 15), 0.5, (255, 255, 255), 1),  # fps
+    ((5, 35), 0.5, (0, 255, 0), 1),  # confidence
+    ((5, 55), 0.5, (0, 255, 255), 1),  # position
+    ((5, 75), 0.5, (255, 255, 0), 1),  # mode
+    ((5, 95), 0.8, (0, 0, 255), 2),  # status
+)
+
+hud = np.zeros((HUD_H, CAM_W, 4), np.uint8)
+hud_mask = np.zeros((HUD_H, CAM_W, 1), bool)
+hud_texts = None
+
+
+def draw_hud(frame: np.ndarray, texts: tuple) -> None:
+    """Blit the HUD onto frame, re-rendering it only if texts changed."""
+    global hud_texts
+    if texts != hud_texts:
+        hud_texts = texts
+        hud.fill(0)
+        for text, (org, scale, color, th) in zip(texts, HUD_STYLE):
+            cv2.putText(
+                hud,
+                text,
+                org,
+                cv2.FONT_HERSHEY_SIMPLEX,
+                scale,
+                color + (255,),
+                th,
+            )
+        np.greater(hud[..., 3:], 0, out=hud_mask)
+
+    np.copyto(frame[:HUD_H], hud[..., :3], where=hud_mask)
+
+
+# ─── Pipeline ──────────────────────────────────────────────────────────
+#
+# capture_loop → frame_slot → infer_loop → out_frame → gen_frames (×N)
+#
+# frame_slot holds a single item and the producer replaces whatever is
+# still waiting in it, so inference always sees the freshest frame.
+# Annotated frames are published as out_frame with a sequence number; every
+# stream client waits for a newer one, so viewers never steal frames from
+# each other and a slow client can never stall the servo loop.
+
+frame_slot = queue.Queue(maxsize=1)  # camera requests (raw frames)
+out_cond = threading.Condition()  # guards out_frame / out_seq
+out_frame = None  # latest annotated frame
+out_seq = 0  # bumped on every publish
+stop_evt = threading.Event()
+
+
+def publish_frame(frame: np.ndarray) -> None:
+    """Make frame the latest annotated frame and wake all stream clients."""
+    global out_frame, out_seq
+    with out_cond:
+        out_frame = frame
+        out_seq += 1
+        out_cond.notify_all()
+
+
+def put_latest(slot: queue.Queue, item, on_drop=None) -> None:
+    """Put item into a single-slot queue, dropping any stale entry.
+
+    on_drop, if given, is called with every item that gets discarded.
+    """
+    try:
+        stale = slot.get_nowait()
+    except queue.Empty:
+        pass
+    else:
+        if on_drop is not None:
+            on_drop(stale)
+    try:
+        slot.put_nowait(item)
+    except queue.Full:
+        if on_drop is not None:
+            on_drop(item)
+
+
+def capture_loop():
+    # Pass whole requests downstream instead of capture_array() copies;
+    # infer_loop maps the buffer in place and releases it when done
+    while not stop_evt.is_set():
         try:
-            frame = picam2.capture_array()
+            req = picam2.capture_request()
         except Exception as exc:  # noqa: BLE001
-            print(f"[WARN] capture_array failed: {exc}")
+            print(f"[WARN] capture_request failed: {exc}")
             time.sleep(0.5)
             continue
+        put_latest(frame_slot, req, on_drop=lambda r: r.release())
+
+
+def servo_loop():
+    """Write the pan/tilt targets set by infer_loop to the servos.
+
+    Keeps the blocking I²C transactions off the inference path; an axis is
+    only rewritten once its target has moved past SERVO_DEADBAND.
+    """
+    sent_pan, sent_tilt = pan, tilt
+    while not stop_evt.is_set():
+        cur_pan, cur_tilt = pan, tilt
+        if abs(cur_pan - sent_pan) > SERVO_DEADBAND:
+            set_angle(PAN_CH, cur_pan)
+            sent_pan = cur_pan
+        if abs(cur_tilt - sent_tilt) > SERVO_DEADBAND:
+            set_angle(TILT_CH, cur_tilt)
+            sent_tilt = cur_tilt
+        time.sleep(SERVO_PERIOD)
+
+
+def detect_target(frame: np.ndarray, now: float):
+    """Run face-then-body detection on a camera frame.
+
+    Updates the face-lock and person-gating state and returns
+    (best_box, best_conf), or (None, 0.0) when nothing is tracked.
+    """
+    global last_face_time, last_face_box, face_locked, next_face_infer_t
+    global tracking_mode, frame_idx, thumb_prev
+    global body_box, body_conf, body_pose
+
+    frame_idx += 1
+
+    # Cheap scene-change measure for gating the person net
+    thumb = cv2.resize(frame, (32, 24), interpolation=cv2.INTER_AREA)
+    scene_diff = (
+        cv2.norm(thumb, thumb_prev, cv2.NORM_L1) / thumb.size
+        if thumb_prev is not None
+        else float("inf")
+    )
+    thumb_prev = thumb
+    body_due = (
+        scene_diff >= BODY_DIFF_THRESH
+        or frame_idx % BODY_EVERY == 0
+        or (pan, tilt) != body_pose
+    )
 
-        # ---- 1) FACE detection ---------------------------------------
-        blob_f = cv2.dnn.blobFromImage(
-            frame,
-            scalefactor=1.0,
-            size=(300, 300),
-            mean=(104.0, 177.0, 123.0),
-        )
-        net_face.setInput(blob_f)
-        det_f = net_face.forward()
+    # Resize once for every full-frame pass this iteration; skipped
+    # while the ROI pass is tracking a locked face
+    use_roi = face_locked and now < next_face_infer_t
+    small = None
+    if not use_roi:
+        small = full_frame_input(frame)
 
+    # No face last frame → the body net will likely be needed, so
+    # start it now and let it overlap with the face pass below
+    fut_p = None
+    if not face_locked and body_due:
+        fut_p = dnn_pool.submit(person_det.detect, small)
+
+    # ---- 1) FACE detection -------------------------------------------
+    try:
         best_face, best_fconf = None, 0.0
-        for i in range(det_f.shape[2]):
-            conf = float(det_f[0, 0, i, 2])
-            if conf < FACE_CONF:
-                continue
-            x1, y1, x2, y2 = (
-                det_f[0, 0, i, 3:7]
-                * np.array([CAM_W, CAM_H, CAM_W, CAM_H])
-            ).astype(int)
-            if (x2 - x1) * (y2 - y1) < MIN_FACE_PIX:
-                continue
-            if conf > best_fconf:
-                best_face, best_fconf = (x1, y1, x2, y2), conf
-
-        if best_face is not None:
-            last_face_box = best_face
-            last_face_time = time.time()
-
-        # Use a recently seen face if available
-        use_face = (
-            (time.time() - last_face_time) < FACE_HOLD_SEC
-            and last_face_box is not None
-        )
-        tracking_mode = "face" if use_face else "none"
-        best_box, best_conf = (
-            (last_face_box, best_fconf) if use_face else (None, 0.0)
-        )
+        if use_roi:
+            # Cheap pass: small ROI around the face we just saw
+            roi = face_roi(last_face_box)
+            rx1, ry1, rx2, ry2 = roi
+            best_face, best_fconf = best_face_in(
+                face_roi_det, frame[ry1:ry2, rx1:rx2], roi
+            )
+
+        if best_face is None:
+            # Full-frame pass: on cadence, or because the ROI lost the face
+            if small is None:
+                small = full_frame_input(frame)
+            best_face, best_fconf = best_face_in(
+                face_det, small, (0, 0, CAM_W, CAM_H)
+            )
+            next_face_infer_t = now + FACE_FULL_INTERVAL
+    finally:
+        # Always collect the body result so person_det is idle next frame,
+        # even when the face pass failed
+        det_p = fut_p.result() if fut_p is not None else None
+
+    face_locked = best_face is not None
+    if best_face is not None:
+        last_face_box = best_face
+        last_face_time = time.time()
+
+    # Use a recently seen face if available
+    use_face = (
+        (time.time() - last_face_time) < FACE_HOLD_SEC
+        and last_face_box is not None
+    )
+    tracking_mode = "face" if use_face else "none"
+    best_box, best_conf = (
+        (last_face_box, best_fconf) if use_face else (None, 0.0)
+    )
 
-        # ---- 2) BODY detection if no face ----------------------------
-        if tracking_mode == "none":
-            blob_p = cv2.dnn.blobFromImage(
-                frame,
-                scalefactor=0.007843,
-                size=(300, 300),
-                mean=127.5,
+    # ---- 2) BODY detection if no face --------------------------------
+    if tracking_mode == "none":
+        if body_due:
+            if det_p is None:
+                det_p = person_det.detect(small)
+
+            body_box, body_conf = best_detection(
+                det_p,
+                CAM_W,
+                CAM_H,
+                0,
+                0,
+                PERSON_CONF,
+                MIN_BODY_FRAC * CAM_W * CAM_H,
+                PERSON_CLASS,
             )
-            net_person.setInput(blob_p)
-            det_p = net_person.forward()
-
-            for i in range(det_p.shape[2]):
-                conf = float(det_p[0, 0, i, 2])
-                cls = int(det_p[0, 0, i, 1])
-                if conf < PERSON_CONF or cls != PERSON_CLASS:
-                    continue
-                x1, y1, x2, y2 = (
-                    det_p[0, 0, i, 3:7]
-                    * np.array([CAM_W, CAM_H, CAM_W, CAM_H])
-                ).astype(int)
-                if (x2 - x1) * (y2 - y1) < MIN_BODY_FRAC * CAM_W * CAM_H:
-                    continue
-                if conf > best_conf:
-                    best_box, best_conf = (x1, y1, x2, y2), conf
-
-            if best_box is not None:
-                tracking_mode = "body"
-
-        detected = best_box is not None
-
-        # ---- Track or scan -------------------------------------------
-        if detected:
-            x1, y1, x2, y2 = best_box
-            fx, fy = (x1 + x2) // 2, (y1 + y2) // 2
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-
-            # Servo adjust
-            err_x = fx - CX
-            if abs(err_x) > CENTER_TOL_X:
-                pan -= err_x * GAIN_PAN
-                pan = max(PAN_MIN, min(PAN_MAX, pan))
-                set_angle(PAN_CH, pan)
-
-            err_y = fy - CY
-            if abs(err_y) > CENTER_TOL_Y:
-                tilt += TILT_DIR * err_y * GAIN_TILT
-                tilt = max(TILT_MIN, min(TILT_MAX, tilt))
-                set_angle(TILT_CH, tilt)
-
-            last_seen = time.time()
-            last_conf = best_conf
-            last_fx, last_fy = fx, fy
-        else:
-            # No target → maybe scan
-            now = time.time()
-            if now - last_seen > LOST_TIMEOUT:
+            body_pose = (pan, tilt)
+
+        # Static scene and rig: coast on the last person result
+        best_box, best_conf = body_box, body_conf
+        if best_box is not None:
+            tracking_mode = "body"
+    else:
+        # Face mode: force a fresh person pass once the face is gone
+        body_box, body_conf, body_pose = None, 0.0, None
+
+    return best_box, best_conf
+
+
+def infer_step(req) -> np.ndarray:
+    """Detect, steer and annotate one camera request.
+
+    Always releases req; returns the annotated frame for the stream.
+    """
+    global pan, tilt, scan_dir, last_seen
+    global last_conf, last_fx, last_fy, fps_text, fps_t
+
+    t0 = time.perf_counter()
+    try:
+        with MappedArray(req, "main", write=False) as mapped:
+            # Detection reads straight from the camera's DMA buffer
+            best_box, best_conf = detect_target(mapped.array, time.time())
+
+            # Annotations go on a private copy so the buffer can be
+            # handed back to the camera before servo control and drawing
+            frame = mapped.array.copy()
+    finally:
+        req.release()
+
+    detected = best_box is not None
+
+    # ---- Track or scan -------------------------------------------
+    if detected:
+        x1, y1, x2, y2 = best_box
+        fx, fy = (x1 + x2) // 2, (y1 + y2) // 2
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+
+        # Servo adjust
+        err_x = fx - CX
+        if abs(err_x) > CENTER_TOL_X:
+            pan -= err_x * GAIN_PAN
+            pan = max(PAN_MIN, min(PAN_MAX, pan))
+
+        err_y = fy - CY
+        if abs(err_y) > CENTER_TOL_Y:
+            tilt += TILT_DIR * err_y * GAIN_TILT
+            tilt = max(TILT_MIN, min(TILT_MAX, tilt))
+
+        last_seen = time.time()
+        last_conf = best_conf
+        last_fx, last_fy = fx, fy
+    else:
+        # No target → maybe scan
+        now = time.time()
+        if now - last_seen > LOST_TIMEOUT:
+            # Snap to whole degrees so the table entry matches the
+            # angle actually commanded
+            pan = round(pan) + SCAN_STEP * scan_dir
+            if pan > PAN_MAX or pan < PAN_MIN:
+                scan_dir *= -1
                 pan += SCAN_STEP * scan_dir
-                if pan > PAN_MAX or pan < PAN_MIN:
-                    scan_dir *= -1
-                    pan += SCAN_STEP * scan_dir
-
-                t_norm = (pan - PAN_CENTER) / SCAN_RANGE_PAN
-                tilt = (
-                    TILT_CENTER
-                    + SCAN_RANGE_TILT * math.sin(math.pi * SCAN_WAVES * t_norm)
-                )
-                tilt = max(TILT_MIN, min(TILT_MAX, tilt))
-
-                set_angle(PAN_CH, pan)
-                set_angle(TILT_CH, tilt)
-                time.sleep(SCAN_DELAY)
-
-        # ---- Overlay text & HUD --------------------------------------
-        fps = 1.0 / (time.perf_counter() - t0 + 1e-9)
-        cv2.putText(
-            frame,
-            f"{fps:4.1f} fps",
-            (5, 15),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.5,
-            (255, 255, 255),
-            1,
-        )
-        cv2.putText(
-            frame,
+
+            tilt = float(scan_tilt_lut[pan - PAN_MIN])
+            time.sleep(SCAN_DELAY)
+
+    # ---- Overlay text & HUD --------------------------------------
+    # Sample fps at a fixed period so the HUD is not redrawn per frame
+    t1 = time.perf_counter()
+    if t1 - fps_t >= HUD_FPS_PERIOD:
+        fps = 1.0 / (t1 - t0 + 1e-9)
+        fps_text, fps_t = f"{fps:4.1f} fps", t1
+
+    # Simple status text
+    if detected:
+        status = "Tracking"
+    elif time.time() - last_seen < LOST_TIMEOUT:
+        status = "Target lost (hold)"
+    else:
+        status = "Scanning"
+
+    draw_hud(
+        frame,
+        (
+            fps_text,
             f"Conf: {last_conf:.2f}",
-            (5, 35),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.5,
-            (0, 255, 0),
-            1,
-        )
-        cv2.putText(
-            frame,
             f"Pos: ({last_fx},{last_fy})",
-            (5, 55),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.5,
-            (0, 255, 255),
-            1,
-        )
-        cv2.putText(
-            frame,
             f"Mode: {tracking_mode}",
-            (5, 75),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.5,
-            (255, 255, 0),
-            1,
-        )
+            status,
+        ),
+    )
 
-        # Simple status text
-        if detected:
-            status = "Tracking"
-        elif time.time() - last_seen < LOST_TIMEOUT:
-            status = "Target lost (hold)"
-        else:
-            status = "Scanning"
+    # Crosshair at last known target position
+    cx, cy = last_fx, last_fy
+    size, th = 20, 2
+    cv2.line(frame, (cx - size, cy), (cx - 5, cy), (0, 255, 0), th)
+    cv2.line(frame, (cx + 5, cy), (cx + size, cy), (0, 255, 0), th)
+    cv2.line(frame, (cx, cy - size), (cx, cy - 5), (0, 255, 0), th)
+    cv2.line(frame, (cx, cy + 5), (cx, cy + size), (0, 255, 0), th)
+    cv2.circle(frame, (cx, cy), 8, (0, 255, 0), 1)
 
-        cv2.putText(
-            frame,
-            status,
-            (5, 95),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.8,
-            (0, 0, 255),
-            2,
-        )
+    return frame
 
-        # Crosshair at last known target position
-        cx, cy = last_fx, last_fy
-        size, th = 20, 2
-        cv2.line(frame, (cx - size, cy), (cx - 5, cy), (0, 255, 0), th)
-        cv2.line(frame, (cx + 5, cy), (cx + size, cy), (0, 255, 0), th)
-        cv2.line(frame, (cx, cy - size), (cx, cy - 5), (0, 255, 0), th)
-        cv2.line(frame, (cx, cy + 5), (cx, cy + size), (0, 255, 0), th)
-        cv2.circle(frame, (cx, cy), 8, (0, 255, 0), 1)
+
+def infer_loop():
+    while not stop_evt.is_set():
+        try:
+            req = frame_slot.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        try:
+            frame = infer_step(req)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[WARN] inference failed: {exc}")
+            continue
+        publish_frame(frame)
+
+
+# ─── Stream generator ──────────────────────────────────────────────────
+
+JPEG_PARAMS = [
+    cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY,
+    cv2.IMWRITE_JPEG_OPTIMIZE, 0,
+    cv2.IMWRITE_JPEG_PROGRESSIVE, 0,
+]
+
+FRAME_HEAD = b"--frame\r\nContent-Type: image/jpeg\r\n\r\n"
+FRAME_TAIL = b"\r\n"
+
+
+def gen_frames():
+    seen = 0  # sequence number of the last frame sent to this client
+    chunk = None  # last MJPEG part sent, re-sent while the producer stalls
+    while not stop_evt.is_set():
+        with out_cond:
+            fresh = out_cond.wait_for(
+                lambda: out_seq != seen or stop_evt.is_set(),
+                timeout=STREAM_TIMEOUT,
+            )
+            frame, seen = out_frame, out_seq
+        if stop_evt.is_set():
+            return  # shutting down: free this worker
+
+        if not fresh:
+            # The page's <img> never reconnects, so keep the response
+            # open until frames resume
+            if chunk is not None:
+                yield chunk
+            continue
 
         # Encode JPEG and yield as MJPEG frame
-        ret, jpeg = cv2.imencode(".jpg", frame)
+        ret, jpeg = cv2.imencode(".jpg", frame, JPEG_PARAMS)
         if not ret:
             continue
 
-        yield (
-            b"--frame\r\n"
-            b"Content-Type: image/jpeg\r\n\r\n"
-            + jpeg.tobytes()
-            + b"\r\n"
-        )
+        # join() reads the encoded buffer directly: one copy per frame
+        # instead of tobytes() plus two concatenations
+        chunk = b"".join((FRAME_HEAD, jpeg, FRAME_TAIL))
+        yield chunk
 
 
 @app.route("/video_feed")
@@ -397,12 +1060,21 @@ def video_feed():
     return Response(
         gen_frames(),
         mimetype="multipart/x-mixed-replace; boundary=frame",
+        direct_passthrough=True,
     )
 
 
 # ─── Main ──────────────────────────────────────────────────────────────
 
 if __name__ == "__main__":
+    workers = [
+        threading.Thread(target=capture_loop, name="capture", daemon=True),
+        threading.Thread(target=infer_loop, name="infer", daemon=True),
+        threading.Thread(target=servo_loop, name="servo", daemon=True),
+    ]
+    for t in workers:
+        t.start()
+
     try:
         app.run(
             host="0.0.0.0",
@@ -412,8 +1084,14 @@ if __name__ == "__main__":
         )
     finally:
         # Graceful shutdown
+        stop_evt.set()
+        with out_cond:
+            out_cond.notify_all()  # wake stream clients so they return
+        for t in workers:
+            t.join(timeout=2.0)
         for ch in (PAN_CH, TILT_CH):
             pca.channels[ch].duty_cycle = 0
         pca.deinit()
         picam2.close()
+        close_detectors()
         print("Clean shutdown.")